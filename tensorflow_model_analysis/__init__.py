@@ -102,6 +102,7 @@ try:
   from tensorflow_model_analysis.constants import METRICS_KEY
   from tensorflow_model_analysis.constants import MODEL_CENTRIC_MODE
   from tensorflow_model_analysis.constants import PLOTS_KEY
+  from tensorflow_model_analysis.constants import PREDICTIONS_COLUMNS_KEY
   from tensorflow_model_analysis.constants import PREDICTIONS_KEY
   from tensorflow_model_analysis.constants import SLICE_KEY_TYPES_KEY
   from tensorflow_model_analysis.constants import TF_GENERIC
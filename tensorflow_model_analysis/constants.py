@@ -68,6 +68,11 @@ TRANSFORMED_FEATURES_KEY = 'transformed_features'
 LABELS_KEY = 'labels'
 # Predictions key.
 PREDICTIONS_KEY = 'predictions'
+# Batched predictions key. Unlike the other keys, this holds the predictions
+# for the whole batch as a dict of output name to batched array (keyed by
+# model name first when multiple models are used) rather than a list with one
+# entry per example. It is removed when extracts are unbatched.
+PREDICTIONS_COLUMNS_KEY = '_predictions_columns'
 # Example weights key.
 EXAMPLE_WEIGHTS_KEY = 'example_weights'
 # Attributions key.
@@ -13,8 +13,7 @@
 # limitations under the License.
 """Features extractor."""
 
-import copy
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import apache_beam as beam
 import numpy as np
@@ -65,40 +64,143 @@ def _IsSupportedArrowValueType(arrow_type: pa.DataType) -> bool:
           _IsBinaryLike(arrow_type))
 
 
-def _DropUnsupportedColumnsAndFetchRawDataColumn(
-    record_batch: pa.RecordBatch
-) -> Tuple[pa.RecordBatch, Optional[np.ndarray]]:
-  """Drops unsupported columns and fetches the raw data column.
+def _ListArrayToNumpyRows(list_array: pa.Array) -> List[Optional[np.ndarray]]:
+  """Converts a ListArray into a list of per-row numpy arrays.
+
+  The values of the ListArray are converted to a single numpy array once and
+  each row is returned as a view into that array. Null rows are returned as
+  None.
+
+  Args:
+    list_array: An Arrow ListArray or LargeListArray.
+
+  Returns:
+    List containing one numpy array (or None) per row of the ListArray.
+  """
+  offsets = np.asarray(list_array.offsets)
+  # Offsets are relative to the (unsliced) child array, so only convert the
+  # range of values referenced by this (possibly sliced) array.
+  start, end = int(offsets[0]), int(offsets[-1])
+  values = list_array.values.slice(start, end - start).to_numpy(
+      zero_copy_only=False)
+  num_rows = len(list_array)
+  row_lengths = np.diff(offsets)
+  if (not list_array.null_count and num_rows and
+      (row_lengths == row_lengths[0]).all()):
+    # Fast path for fixed length lists (e.g. dense features): the rows can be
+    # split off with a single reshape instead of slicing them one by one.
+    return list(values.reshape(num_rows, row_lengths[0]))
+  offsets = (offsets - start).tolist()
+  rows = [values[begin:end] for begin, end in zip(offsets[:-1], offsets[1:])]
+  if list_array.null_count:
+    is_null = list_array.is_null().to_numpy(zero_copy_only=False)
+    for i in np.flatnonzero(is_null):
+      rows[i] = None
+  return rows
+
+
+def _GetColumnIndices(schema: pa.Schema) -> Tuple[Optional[int], List[int]]:
+  """Returns the indices of the raw data column and the supported columns.
 
   Currently, types that are not binary_like or ListArray[primitive types] are
-  dropped.
+  not supported.
 
   Args:
-    record_batch: An Arrow RecordBatch.
+    schema: The schema of an Arrow RecordBatch.
 
   Returns:
-    Arrow RecordBatch with only supported columns.
+    A tuple of the index of the raw data column (None if there is no such
+    column) and the indices of the supported columns.
   """
-  column_names, column_arrays = [], []
-  serialized_examples = None
-  for column_name, column_array in zip(record_batch.schema.names,
-                                       record_batch.columns):
-    column_type = column_array.type
-    if column_name == constants.ARROW_INPUT_COLUMN:
+  raw_data_column_index = None
+  supported_column_indices = []
+  for column_index, field in enumerate(schema):
+    column_type = field.type
+    if field.name == constants.ARROW_INPUT_COLUMN:
       assert (_IsListLike(column_type) and
               _IsBinaryLike(column_type.value_type)), (
                   'Invalid type for batched input key: {}. '
                   'Expected binary like.'.format(column_type))
-      serialized_examples = np.asarray(column_array.flatten())
+      raw_data_column_index = column_index
     # Currently we only handle columns of type list<primitive|binary_like>.
     # We ignore other columns as we cannot efficiently convert them into an
     # instance dict format.
     elif (_IsListLike(column_type) and
           _IsSupportedArrowValueType(column_type.value_type)):
-      column_names.append(column_name)
-      column_arrays.append(column_array)
-  return (pa.RecordBatch.from_arrays(column_arrays,
-                                     column_names), serialized_examples)
+      supported_column_indices.append(column_index)
+  return raw_data_column_index, supported_column_indices
+
+
+def _DropUnsupportedColumnsAndFetchRawDataColumn(
+    record_batch: pa.RecordBatch, raw_data_column_index: Optional[int],
+    supported_column_indices: List[int]
+) -> Tuple[List[str], List[List[Optional[np.ndarray]]], Optional[np.ndarray]]:
+  """Drops unsupported columns and fetches the raw data column.
+
+  The supported columns are converted to numpy once here so that no
+  intermediate RecordBatch needs to be built.
+
+  Args:
+    record_batch: An Arrow RecordBatch.
+    raw_data_column_index: Index of the raw data column as returned by
+      _GetColumnIndices.
+    supported_column_indices: Indices of the supported columns as returned by
+      _GetColumnIndices.
+
+  Returns:
+    A tuple of the names of the supported columns, the per-row numpy values of
+    each supported column and the serialized examples from the raw data column.
+  """
+  serialized_examples = None
+  if raw_data_column_index is not None:
+    # Take the referenced range of the child values array directly rather than
+    # calling flatten(), which allocates a new array.
+    raw_data_column = record_batch.column(raw_data_column_index)
+    start = raw_data_column.offsets[0].as_py()
+    end = raw_data_column.offsets[-1].as_py()
+    serialized_examples = raw_data_column.values.slice(
+        start, end - start).to_numpy(zero_copy_only=False)
+  column_names = record_batch.schema.names
+  return ([column_names[i] for i in supported_column_indices], [
+      _ListArrayToNumpyRows(record_batch.column(i))
+      for i in supported_column_indices
+  ], serialized_examples)
+
+
+@beam.typehints.with_input_types(types.Extracts)
+@beam.typehints.with_output_types(types.Extracts)
+class _ExtractFeaturesFn(beam.DoFn):
+  """A DoFn that extracts features from extracts containing arrow table."""
+
+  def __init__(self):
+    # The record batches of a PCollection almost always share the same schema,
+    # so the column indices of the last seen schema are cached to avoid
+    # re-checking the type of every column for every batch.
+    self._cached_schema = None
+    self._cached_column_indices = None
+
+  def process(self, batched_extract: types.Extracts) -> List[types.Extracts]:
+    result = dict(batched_extract)
+    record_batch = batched_extract[constants.ARROW_RECORD_BATCH_KEY]
+    if (self._cached_schema is None or
+        not record_batch.schema.equals(self._cached_schema)):
+      self._cached_column_indices = _GetColumnIndices(record_batch.schema)
+      self._cached_schema = record_batch.schema
+    (column_names, column_rows, serialized_examples) = (
+        _DropUnsupportedColumnsAndFetchRawDataColumn(
+            record_batch, *self._cached_column_indices))
+    if not column_names:
+      result[constants.FEATURES_KEY] = [
+          dict() for _ in range(record_batch.num_rows)
+      ]
+    else:
+      result[constants.FEATURES_KEY] = [
+          dict(zip(column_names, row)) for row in zip(*column_rows)
+      ]
+    # TODO(pachristopher): Consider avoiding setting this key if we don't need
+    # this any further in the pipeline. This can avoid a potentially costly copy
+    result[constants.INPUT_KEY] = serialized_examples
+    return [result]
 
 
 @beam.ptransform_fn
@@ -115,24 +217,4 @@ def _ExtractFeatures(
     PCollection of extracts with additional features added under the key
     tfma.FEATURES_KEY.
   """
-
-  def extract_features(  # pylint: disable=invalid-name
-      batched_extract: types.Extracts) -> types.Extracts:
-    """Extract features from extracts containing arrow table."""
-    result = copy.copy(batched_extract)
-    (record_batch, serialized_examples) = (
-        _DropUnsupportedColumnsAndFetchRawDataColumn(
-            batched_extract[constants.ARROW_RECORD_BATCH_KEY]))
-    # Special case: if record_batch contains 0 column, it will have 0 row, but
-    # we want a list of empty dicts, of the same length as serialized_examples.
-    if record_batch.num_columns == 0:
-      result[constants.FEATURES_KEY] = [dict() for _ in serialized_examples]
-    else:
-      dataframe = record_batch.to_pandas()
-      result[constants.FEATURES_KEY] = dataframe.to_dict(orient='records')
-    # TODO(pachristopher): Consider avoiding setting this key if we don't need
-    # this any further in the pipeline. This can avoid a potentially costly copy
-    result[constants.INPUT_KEY] = serialized_examples
-    return result
-
-  return extracts | 'ExtractFeatures' >> beam.Map(extract_features)
+  return extracts | 'ExtractFeatures' >> beam.ParDo(_ExtractFeaturesFn())
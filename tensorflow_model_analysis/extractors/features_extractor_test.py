@@ -17,6 +17,7 @@ from absl.testing import parameterized
 import apache_beam as beam
 from apache_beam.testing import util
 import numpy as np
+import pyarrow as pa
 import tensorflow as tf
 from tensorflow_model_analysis import constants
 from tensorflow_model_analysis.api import model_eval_lib
@@ -149,6 +150,124 @@ class FeaturesExtractorTest(testutil.TensorflowModelAnalysisTest,
 
       util.assert_that(result, check_result, label='result')
 
+  def test_features_extractor_variable_length_and_missing_features(self):
+    model_spec = config_pb2.ModelSpec()
+    eval_config = config_pb2.EvalConfig(model_specs=[model_spec])
+    feature_extractor = features_extractor.FeaturesExtractor(eval_config)
+
+    schema = text_format.Parse(
+        """
+        feature {
+          name: "varlen_int"
+          type: INT
+        }
+        feature {
+          name: "optional_string"
+          type: BYTES
+        }
+        """, schema_pb2.Schema())
+    tfx_io = tf_example_record.TFExampleBeamRecord(
+        schema=schema,
+        raw_record_column_name=constants.ARROW_INPUT_COLUMN,
+        physical_format='inmem',
+        telemetry_descriptors=['testing'])
+
+    example_kwargs = [
+        {
+            'varlen_int': [1, 2, 3],
+            'optional_string': 'string1'
+        },
+        {
+            'varlen_int': [4]
+        },
+    ]
+
+    with beam.Pipeline() as pipeline:
+      # pylint: disable=no-value-for-parameter
+      result = (
+          pipeline
+          | 'Create' >> beam.Create([
+              self._makeExample(**kwargs).SerializeToString()
+              for kwargs in example_kwargs
+          ],
+                                    reshuffle=False)
+          | 'DecodeToRecordBatch' >> tfx_io.BeamSource(batch_size=2)
+          | 'InputsToExtracts' >> model_eval_lib.BatchedInputsToExtracts()
+          | feature_extractor.stage_name >> feature_extractor.ptransform)
+
+      # pylint: enable=no-value-for-parameter
+
+      def check_result(got):
+        try:
+          self.assertLen(got, 1)
+          features = got[0][constants.FEATURES_KEY]
+          self.assertLen(features, 2)
+          np.testing.assert_array_equal(features[0]['varlen_int'], [1, 2, 3])
+          np.testing.assert_array_equal(features[0]['optional_string'],
+                                        [b'string1'])
+          np.testing.assert_array_equal(features[1]['varlen_int'], [4])
+          self.assertIsNone(features[1]['optional_string'])
+        except AssertionError as err:
+          raise util.BeamAssertException(err)
+
+      util.assert_that(result, check_result, label='result')
+
+  def test_features_extractor_with_changing_schema(self):
+    extract_features_fn = features_extractor._ExtractFeaturesFn()  # pylint: disable=protected-access
+
+    def extract(record_batch):
+      result = extract_features_fn.process(
+          {constants.ARROW_RECORD_BATCH_KEY: record_batch})
+      self.assertLen(result, 1)
+      return result[0]
+
+    record_batch1 = pa.RecordBatch.from_arrays([
+        pa.array([[b'example1'], [b'example2']], type=pa.list_(pa.binary())),
+        pa.array([[1], [2]], type=pa.list_(pa.int64())),
+        pa.array([[1.0], [2.0]], type=pa.list_(pa.float32())),
+    ], [constants.ARROW_INPUT_COLUMN, 'a', 'b'])
+    # Drops column 'a', adds column 'c' and removes the raw data column, which
+    # changes the indices of the supported columns.
+    record_batch2 = pa.RecordBatch.from_arrays([
+        pa.array([[b'c1'], [b'c2']], type=pa.list_(pa.binary())),
+        pa.array([[3.0], [4.0]], type=pa.list_(pa.float32())),
+    ], ['c', 'b'])
+
+    for record_batch, expected_features, expected_input in (
+        (record_batch1, [{
+            'a': [1],
+            'b': [1.0]
+        }, {
+            'a': [2],
+            'b': [2.0]
+        }], [b'example1', b'example2']),
+        (record_batch2, [{
+            'b': [3.0],
+            'c': [b'c1']
+        }, {
+            'b': [4.0],
+            'c': [b'c2']
+        }], None),
+        (record_batch1, [{
+            'a': [1],
+            'b': [1.0]
+        }, {
+            'a': [2],
+            'b': [2.0]
+        }], [b'example1', b'example2']),
+    ):
+      got = extract(record_batch)
+      features = got[constants.FEATURES_KEY]
+      self.assertLen(features, len(expected_features))
+      for got_row, expected_row in zip(features, expected_features):
+        self.assertCountEqual(expected_row, got_row)
+        for name, value in expected_row.items():
+          np.testing.assert_array_equal(got_row[name], value)
+      if expected_input is None:
+        self.assertIsNone(got[constants.INPUT_KEY])
+      else:
+        np.testing.assert_array_equal(got[constants.INPUT_KEY], expected_input)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -14,14 +14,13 @@
 """Predict extractor for TFJS models."""
 
 import collections
-import copy
+from concurrent import futures
 import json
 import os
+import shutil
 import subprocess
 import tempfile
-from typing import Dict, Union, Sequence
-
-import uuid
+from typing import Any, Dict, List, Sequence, Tuple, Union
 
 import apache_beam as beam
 import numpy as np
@@ -33,6 +32,15 @@ from tensorflow_model_analysis.extractors.tfjs_predict_extractor_util import get
 from tensorflow_model_analysis.proto import config_pb2
 from tensorflow_model_analysis.utils import model_util
 
+# orjson is optional. If available it is used to encode and decode the data
+# exchanged with the tfjs binary, as it can serialize numpy arrays directly.
+# pylint: disable=g-import-not-at-top
+try:
+  import orjson
+except ImportError:
+  orjson = None
+# pylint: enable=g-import-not-at-top
+
 _TFJS_PREDICT_EXTRACTOR_STAGE_NAME = 'ExtractTFJSPredictions'
 
 _MODELS_SUBDIR = 'Models'
@@ -45,6 +53,54 @@ _DTYPE_JSON = 'dtype.json'
 _SHAPE_JSON = 'shape.json'
 _TF_INPUT_NAME_JSON = 'tf_input_name.json'
 
+_MAX_COPY_WORKERS = 16
+
+# Numpy dtype kinds that orjson can serialize natively.
+_ORJSON_NUMPY_KINDS = 'biuf'
+
+
+def _to_json_value(value: np.ndarray) -> Union[np.ndarray, List[Any]]:
+  """Returns the flattened value in a form that _dumps_json can serialize."""
+  value = value.ravel()
+  if orjson is not None and value.dtype.kind in _ORJSON_NUMPY_KINDS:
+    return value
+  return value.tolist()
+
+
+def _dumps_json(value: Any) -> bytes:
+  if orjson is not None:
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+  return json.dumps(value).encode('utf-8')
+
+
+def _loads_json(content: bytes) -> Any:
+  if orjson is not None:
+    return orjson.loads(content)
+  return json.loads(content)
+
+
+def _copy_model_dir(src_path: str, dst_path: str) -> None:
+  """Copies the model directory at src_path to the local path dst_path."""
+  if '://' not in src_path:
+    # For local models let shutil copy the whole tree, which uses efficient
+    # kernel level copies where available.
+    shutil.copytree(src_path, dst_path)
+    return
+  # For remote file systems the copy is latency bound, so copy the files in
+  # parallel.
+  with futures.ThreadPoolExecutor(max_workers=_MAX_COPY_WORKERS) as executor:
+    copies = []
+    for directory, _, files in tf.io.gfile.walk(src_path):
+      cur_path = os.path.join(dst_path, os.path.relpath(directory, src_path))
+      tf.io.gfile.makedirs(cur_path)
+      for f in files:
+        copies.append(
+            executor.submit(tf.io.gfile.copy, os.path.join(directory, f),
+                            os.path.join(cur_path, f)))
+    for future in futures.as_completed(copies):
+      # Surface any errors raised while copying.
+      future.result()
+
 
 # TODO(b/149981535) Determine if we should merge with RunInference.
 @beam.typehints.with_input_types(types.Extracts)
@@ -59,6 +115,7 @@ class _TFJSPredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
     self._src_model_paths = {
         k: v.model_path for k, v in eval_shared_models.items()
     }
+    self._exchange_path = None
 
   def setup(self):
     super().setup()
@@ -66,6 +123,9 @@ class _TFJSPredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
 
     base_path = tempfile.mkdtemp()
     base_model_path = os.path.join(base_path, _MODELS_SUBDIR)
+    # The tfjs binary can only exchange data through files. These are kept in
+    # a separate directory that is removed on teardown.
+    self._exchange_path = tempfile.mkdtemp()
 
     self._model_properties = {}
     for model_name, model_path in self._src_model_paths.items():
@@ -85,37 +145,66 @@ class _TFJSPredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
           model_outputs[k] = [int(i['size']) for i in v['tensorShape']['dim']]
 
       cur_model_path = os.path.join(base_model_path, model_name)
+      # Every batch for this model exchanges data with the tfjs binary through
+      # the same input and output directories. The files in them are
+      # overwritten by each batch, so the directories are only created once.
+      input_path = os.path.join(self._exchange_path, model_name,
+                                _EXAMPLES_SUBDIR)
+      output_path = os.path.join(self._exchange_path, model_name,
+                                 _OUTPUTS_SUBDIR)
       self._model_properties[model_name] = {
           'inputs': model_inputs,
           'outputs': model_outputs,
-          'path': cur_model_path
+          # Tuples of (input name, input name without the tensor index suffix,
+          # input dims). The short name is the name of the feature to use.
+          'input_specs': [(k, k.split(':')[0], dim)
+                          for k, dim in model_inputs.items()],
+          'output_names': [k.split(':')[0] for k in model_outputs],
+          'path': cur_model_path,
+          'input_path': input_path,
+          'output_path': output_path,
+          'inference_command': [
+              self._binary_path,
+              '--model_path=' + os.path.join(cur_model_path, _MODEL_JSON),
+              '--inputs_dir=' + input_path, '--outputs_dir=' + output_path
+          ]
       }
 
       # We copy models to local tmp storage so that the tfjs binary can
       # access them.
-      tf.io.gfile.makedirs(cur_model_path)
-      for directory, _, files in tf.io.gfile.walk(model_path):
-        cur_path = os.path.join(cur_model_path,
-                                os.path.relpath(directory, model_path))
-        tf.io.gfile.makedirs(cur_path)
-        for f in files:
-          src_path = os.path.join(directory, f)
-          tf.io.gfile.copy(src_path, os.path.join(cur_path, f))
+      _copy_model_dir(model_path, cur_model_path)
+
+      tf.io.gfile.makedirs(input_path)
+      tf.io.gfile.makedirs(output_path)
+
+  def teardown(self):
+    # Release the data exchange directory.
+    if self._exchange_path:
+      shutil.rmtree(self._exchange_path, ignore_errors=True)
+    super().teardown()
+
+  def _run_inference(self,
+                     inference_command: List[str]) -> Tuple[int, bytes, bytes]:
+    """Runs the tfjs binary and returns its exit code, stdout and stderr."""
+    popen = subprocess.Popen(
+        inference_command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = popen.communicate()
+    return popen.returncode, stdout, stderr
 
   def _batch_reducible_process(
       self, element: types.Extracts) -> Sequence[types.Extracts]:
     """Invokes the tfjs model on the provided inputs and stores the result."""
-    result = copy.copy(element)
+    result = dict(element)
     result[constants.PREDICTIONS_KEY] = []
+    result[constants.PREDICTIONS_COLUMNS_KEY] = {}
 
-    batched_features = collections.defaultdict(list)
     feature_rows = element[constants.FEATURES_KEY]
-    for r in feature_rows:
-      for key, value in r.items():
-        if value.dtype == np.int64:
-          value = value.astype(np.int32)
-        batched_features[key].append(value)
 
+    inferences = []
+    inference_commands = []
     for spec in self._eval_config.model_specs:
       model_name = spec.name if len(self._eval_config.model_specs) > 1 else ''
       if model_name not in self._loaded_models:
@@ -123,100 +212,92 @@ class _TFJSPredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
             spec.name, self._eval_config))
 
       model_features = {}
-      for k in self._model_properties[model_name]['inputs']:
-        k_name = k.split(':')[0]
-        if k_name not in batched_features:
+      for k, k_name, dim in self._model_properties[model_name]['input_specs']:
+        if any(k_name not in r for r in feature_rows):
           raise ValueError('model requires feature "{}" not available in '
                            'input.'.format(k_name))
-        dim = self._model_properties[model_name]['inputs'][k]
-        elems = []
-        for i in batched_features[k_name]:
-          if np.ndim(i) > len(dim):
-            raise ValueError('ranks for input "{}" are not compatible '
-                             'with the model.'.format(k_name))
-          # TODO(dzats): See if we can support case where multiple dimensions
-          # are not defined.
-          elems.append(np.reshape(i, dim))
-        model_features[k] = elems
-
-      model_features = {k: np.concatenate(v) for k, v in model_features.items()}
+        # Stack all rows at once so that the cast and reshape below are single
+        # vectorized operations over the whole batch.
+        value = np.stack([r[k_name] for r in feature_rows])
+        if value.ndim - 1 > len(dim):
+          raise ValueError('ranks for input "{}" are not compatible '
+                           'with the model.'.format(k_name))
+        if value.dtype == np.int64:
+          value = value.astype(np.int32)
+        # TODO(dzats): See if we can support case where multiple dimensions
+        # are not defined.
+        model_features[k] = np.reshape(value, [-1] + dim[1:])
 
+      # The tfjs binary only accepts JSON inputs. Since the shape is passed
+      # separately, the data is written flattened to avoid encoding nested
+      # lists.
       batched_entries = collections.defaultdict(list)
       for feature, value in model_features.items():
-        batched_entries[_DATA_JSON].append(value.tolist())
+        batched_entries[_DATA_JSON].append(_to_json_value(value))
         batched_entries[_DTYPE_JSON].append(str(value.dtype))
         batched_entries[_SHAPE_JSON].append(value.shape)
         batched_entries[_TF_INPUT_NAME_JSON].append(feature)
 
-      cur_subdir = str(uuid.uuid4())
-      cur_input_path = os.path.join(self._model_properties[model_name]['path'],
-                                    _EXAMPLES_SUBDIR, cur_subdir)
-      tf.io.gfile.makedirs(cur_input_path)
+      cur_input_path = self._model_properties[model_name]['input_path']
       for entry, value in batched_entries.items():
-        with tf.io.gfile.GFile(os.path.join(cur_input_path, entry), 'w') as f:
-          f.write(json.dumps(value))
-
-      cur_output_path = os.path.join(self._model_properties[model_name]['path'],
-                                     _OUTPUTS_SUBDIR, cur_subdir)
-      tf.io.gfile.makedirs(cur_output_path)
-      inference_command = [
-          self._binary_path, '--model_path=' +
-          os.path.join(self._model_properties[model_name]['path'], _MODEL_JSON),
-          '--inputs_dir=' + cur_input_path, '--outputs_dir=' + cur_output_path
+        with tf.io.gfile.GFile(os.path.join(cur_input_path, entry), 'wb') as f:
+          f.write(_dumps_json(value))
+
+      inferences.append((spec, model_name))
+      inference_commands.append(
+          self._model_properties[model_name]['inference_command'])
+
+    # The tfjs binary is invoked once per model. When there are multiple
+    # models, run the invocations concurrently so that the process start up
+    # and model loading costs of the different models overlap rather than add
+    # up.
+    if len(inference_commands) > 1:
+      with futures.ThreadPoolExecutor(
+          max_workers=len(inference_commands)) as executor:
+        inference_results = list(
+            executor.map(self._run_inference, inference_commands))
+    else:
+      inference_results = [
+          self._run_inference(command) for command in inference_commands
       ]
 
-      popen = subprocess.Popen(
-          inference_command,
-          stdin=subprocess.PIPE,
-          stdout=subprocess.PIPE,
-          stderr=subprocess.PIPE)
-      stdout, stderr = popen.communicate()
-      if popen.returncode != 0:
+    for (spec, model_name), inference_result in zip(inferences,
+                                                    inference_results):
+      returncode, stdout, stderr = inference_result
+      if returncode != 0:
         raise ValueError(
             'Inference failed with status {}\nstdout:\n{}\nstderr:\n{}'.format(
-                popen.returncode, stdout, stderr))
+                returncode, stdout, stderr))
 
+      cur_output_path = self._model_properties[model_name]['output_path']
       try:
-        with tf.io.gfile.GFile(os.path.join(cur_output_path, _DATA_JSON)) as f:
-          data = json.load(f)
-        with tf.io.gfile.GFile(os.path.join(cur_output_path, _DTYPE_JSON)) as f:
-          dtype = json.load(f)
-        with tf.io.gfile.GFile(os.path.join(cur_output_path, _SHAPE_JSON)) as f:
-          shape = json.load(f)
+        with tf.io.gfile.GFile(
+            os.path.join(cur_output_path, _DATA_JSON), 'rb') as f:
+          data = _loads_json(f.read())
+        with tf.io.gfile.GFile(
+            os.path.join(cur_output_path, _DTYPE_JSON), 'rb') as f:
+          dtype = _loads_json(f.read())
+        with tf.io.gfile.GFile(
+            os.path.join(cur_output_path, _SHAPE_JSON), 'rb') as f:
+          shape = _loads_json(f.read())
       except FileNotFoundError as e:
         raise FileNotFoundError(
             'Unable to find files containing inference result. This likely '
             'means that inference did not succeed. Error {}'.format(e))
-
-      name = [
-          n.split(':')[0]
-          for n in self._model_properties[model_name]['outputs'].keys()
-      ]
-
-      tf.io.gfile.rmtree(cur_input_path)
-      tf.io.gfile.rmtree(cur_output_path)
+      # Remove the consumed results so that a later failed inference can not
+      # silently pick up the results of this batch.
+      tf.io.gfile.remove(os.path.join(cur_output_path, _DATA_JSON))
 
       outputs = {}
-      for n, s, t, d in zip(name, shape, dtype, data):
-        d_val = [d[str(i)] for i in range(len(d))]
-        outputs[n] = np.reshape(np.array(d_val, t), s)
-
-      for v in outputs.values():
-        if len(v) != len(feature_rows):
-          raise ValueError('Did not get the expected number of results.')
-
-      for i in range(len(feature_rows)):
-        output = {k: v[i] for k, v in outputs.items()}
-
-        if len(output) == 1:
-          output = list(output.values())[0]
-
-        if len(self._eval_config.model_specs) == 1:
-          result[constants.PREDICTIONS_KEY].append(output)
-        else:
-          if i >= len(result[constants.PREDICTIONS_KEY]):
-            result[constants.PREDICTIONS_KEY].append({})
-          result[constants.PREDICTIONS_KEY][i].update({spec.name: output})
+      for n, s, t, d in zip(self._model_properties[model_name]['output_names'],
+                            shape, dtype, data):
+        # Typed arrays are serialized by the tfjs binary as objects keyed by
+        # index, which are written (and parsed) in ascending index order.
+        outputs[n] = np.reshape(np.fromiter(d.values(), t, count=len(d)), s)
+
+      model_util.add_batched_outputs_to_extracts(
+          result, outputs, spec.name,
+          len(self._eval_config.model_specs) > 1, len(feature_rows))
     return [result]
 
 
@@ -257,6 +338,8 @@ def TFJSPredictExtractor(  # pylint: disable=invalid-name
   extract added for the predictions keyed by tfma.PREDICTIONS_KEY. The model
   inputs are searched for under tfma.FEATURES_KEY. If multiple
   models are used the predictions will be stored in a dict keyed by model name.
+  The batched model outputs are also stored under tfma.PREDICTIONS_COLUMNS_KEY
+  as a dict of output name to batched array.
 
   Args:
     eval_config: Eval config.
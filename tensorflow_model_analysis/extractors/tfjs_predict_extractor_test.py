@@ -170,6 +170,15 @@ class TFJSPredictExtractorTest(testutil.TensorflowModelAnalysisTest,
               self.assertIn('Identity', item)
               self.assertIn('Identity_1', item)
 
+          self.assertIn(constants.PREDICTIONS_COLUMNS_KEY, got)
+          prediction_columns = got[constants.PREDICTIONS_COLUMNS_KEY]
+          if multi_model:
+            self.assertCountEqual(['model1', 'model2'], prediction_columns)
+            prediction_columns = prediction_columns['model1']
+          self.assertLen(prediction_columns, 2 if multi_output else 1)
+          for column in prediction_columns.values():
+            self.assertLen(column, 2)
+
         except AssertionError as err:
           raise util.BeamAssertException(err)
 
@@ -14,8 +14,7 @@
 """Predict extractor for TFLite models."""
 
 import collections
-import copy
-from typing import Dict, Sequence, Union
+from typing import Any, Dict, Sequence, Tuple, Union
 
 from absl import logging
 import apache_beam as beam
@@ -29,6 +28,22 @@ from tensorflow_model_analysis.utils import model_util
 
 _TFLITE_PREDICT_EXTRACTOR_STAGE_NAME = 'ExtractTFLitePredictions'
 
+# Missing features are only logged for one in this many batches per input.
+_LOG_MISSING_FEATURE_EVERY_N_BATCHES = 100
+
+
+def _get_buffer_type_and_default(input_type: Any) -> Tuple[Any, Any]:
+  """Returns the batch buffer type and missing value default for an input."""
+  kind = np.dtype(input_type).kind
+  if kind in 'if':
+    return input_type, -1
+  if kind == 'u':
+    # -1 is not representable by unsigned types (e.g. quantized uint8 inputs).
+    return input_type, 0
+  if kind == 'b':
+    return input_type, False
+  return object, ''
+
 
 # TODO(b/149981535) Determine if we should merge with RunInference.
 @beam.typehints.with_input_types(types.Extracts)
@@ -44,9 +59,29 @@ class _TFLitePredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
   def setup(self):
     super().setup()
     self._interpreters = {}
+    self._model_properties = {}
+    # Number of batches with missing values keyed by input name.
+    self._num_batches_with_missing_feature = collections.Counter()
     for model_name, model_contents in self._loaded_models.items():
-      self._interpreters[model_name] = tf.lite.Interpreter(
-          model_content=model_contents.contents)
+      interpreter = tf.lite.Interpreter(model_content=model_contents.contents)
+      interpreter.allocate_tensors()
+      self._interpreters[model_name] = interpreter
+      # The input and output details only depend on the model, so look them up
+      # once here rather than for every batch.
+      input_details = interpreter.get_input_details()
+      output_details = interpreter.get_output_details()
+      self._model_properties[model_name] = {
+          'input_names': [
+              self._get_input_name_from_input_detail(i) for i in input_details
+          ],
+          # Shapes the input tensors are currently allocated with. These are
+          # updated whenever the inputs are resized to a new batch size.
+          'input_shapes': [tuple(i['shape']) for i in input_details],
+          'input_types': [i['dtype'] for i in input_details],
+          'input_indices': [i['index'] for i in input_details],
+          'output_names': [o['name'] for o in output_details],
+          'output_indices': [o['index'] for o in output_details],
+      }
 
   def _get_input_name_from_input_detail(self, input_detail):
     """Get input name from input detail.
@@ -70,8 +105,9 @@ class _TFLitePredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
   def _batch_reducible_process(
       self, element: types.Extracts) -> Sequence[types.Extracts]:
     """Invokes the tflite model on the provided inputs and stores the result."""
-    result = copy.copy(element)
+    result = dict(element)
     result[constants.PREDICTIONS_KEY] = []
+    result[constants.PREDICTIONS_COLUMNS_KEY] = {}
     feature_rows = element[constants.FEATURES_KEY]
 
     for spec in self._eval_config.model_specs:
@@ -81,62 +117,92 @@ class _TFLitePredictionDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
             spec.name, self._eval_config))
 
       interpreter = self._interpreters[model_name]
+      model_properties = self._model_properties[model_name]
 
-      input_details = interpreter.get_input_details()
-      output_details = interpreter.get_output_details()
-
-      input_features = collections.defaultdict(list)
-      for i in input_details:
-        input_name = self._get_input_name_from_input_detail(i)
+      input_features = {}
+      for input_name, current_shape, input_type in zip(
+          model_properties['input_names'], model_properties['input_shapes'],
+          model_properties['input_types']):
         # The batch dimension is the specific batch size of the last time the
-        # model was invoked. Set it to 1 to "reset".
-        input_shape = [1] + list(i['shape'])[1:]
-        input_type = i['dtype']
-        for r in feature_rows:
+        # model was invoked, so only the remaining dimensions are used.
+        row_shape = tuple(current_shape[1:])
+        buffer_type, default = _get_buffer_type_and_default(input_type)
+        # Only built when the first missing value is found, as usually none of
+        # the values are missing.
+        default_value = None
+        # Fill a preallocated batch buffer in place rather than concatenating a
+        # list of per-row arrays.
+        batched_value = np.empty((len(feature_rows),) + row_shape,
+                                 dtype=buffer_type)
+        num_missing = 0
+        for i, r in enumerate(feature_rows):
           value = r.get(input_name)
-          if value is None or np.any(np.equal(value, None)):
-            default = -1 if input_type in [np.float32, np.int64] else ''
-            value = np.empty(input_shape)
-            value.fill(default)
-            value = value.astype(input_type)
-            logging.log_every_n(logging.WARNING,
-                                'Feature %s not found. Setting default value.',
-                                100, input_name)
+          # Only object arrays can contain None, so avoid the (slow) object
+          # comparison for numeric values.
+          if value is None or (value.dtype == object and
+                               np.any(np.equal(value, None))):
+            if default_value is None:
+              default_value = np.full(row_shape, default, dtype=buffer_type)
+            batched_value[i] = default_value
+            num_missing += 1
           else:
-            value = np.reshape(value, input_shape)
-          input_features[input_name].append(value)
-        input_features[input_name] = tf.concat(
-            input_features[input_name], axis=0)
-        if np.shape(input_features[input_name]) != tuple(i['shape']):
-          interpreter.resize_tensor_input(i['index'],
-                                          np.shape(input_features[input_name]))
-      interpreter.allocate_tensors()
+            # Assigning to the buffer casts the value to the input type, so
+            # make sure that incompatible values (e.g. floats for an integer
+            # input) are still rejected.
+            if not np.can_cast(value.dtype, buffer_type, casting='same_kind'):
+              raise ValueError(
+                  'feature "{}" has type {} which is not compatible with the '
+                  'model input type {}.'.format(input_name, value.dtype,
+                                                np.dtype(input_type)))
+            batched_value[i] = np.reshape(value, row_shape)
+        if num_missing:
+          # Rate limit per input so that inputs that are routinely missing do
+          # not flood the logs without hiding the other inputs.
+          if (self._num_batches_with_missing_feature[input_name] %
+              _LOG_MISSING_FEATURE_EVERY_N_BATCHES == 0):
+            logging.warning(
+                'Feature %s not found in %d of %d examples. Setting default '
+                'value.', input_name, num_missing, len(feature_rows))
+          self._num_batches_with_missing_feature[input_name] += 1
+        input_features[input_name] = batched_value
+
+      input_shapes = [
+          input_features[input_name].shape
+          for input_name in model_properties['input_names']
+      ]
+      if input_shapes != model_properties['input_shapes']:
+        try:
+          for input_index, input_shape, current_shape in zip(
+              model_properties['input_indices'], input_shapes,
+              model_properties['input_shapes']):
+            if input_shape != current_shape:
+              interpreter.resize_tensor_input(input_index, input_shape)
+          interpreter.allocate_tensors()
+        except Exception:  # pylint: disable=broad-except
+          # Some inputs may have been resized even though the allocation
+          # failed (e.g. for models with a fixed batch size), so re-read the
+          # actual shapes to make sure that a retry with a different batch size
+          # (e.g. the batch size 1 fallback) resizes the inputs again.
+          model_properties['input_shapes'] = [
+              tuple(i['shape']) for i in interpreter.get_input_details()
+          ]
+          raise
+        model_properties['input_shapes'] = input_shapes
 
-      for i in input_details:
-        input_name = self._get_input_name_from_input_detail(i)
-        interpreter.set_tensor(i['index'], input_features[input_name])
+      for input_name, input_index in zip(model_properties['input_names'],
+                                         model_properties['input_indices']):
+        interpreter.set_tensor(input_index, input_features[input_name])
       interpreter.invoke()
 
       outputs = {
-          o['name']: interpreter.get_tensor(o['index']) for o in output_details
+          name: interpreter.get_tensor(index) for name, index in zip(
+              model_properties['output_names'],
+              model_properties['output_indices'])
       }
 
-      for v in outputs.values():
-        if len(v) != len(feature_rows):
-          raise ValueError('Did not get the expected number of results.')
-
-      for i in range(len(feature_rows)):
-        output = {k: v[i] for k, v in outputs.items()}
-
-        if len(output) == 1:
-          output = list(output.values())[0]
-
-        if len(self._eval_config.model_specs) == 1:
-          result[constants.PREDICTIONS_KEY].append(output)
-        else:
-          if i >= len(result[constants.PREDICTIONS_KEY]):
-            result[constants.PREDICTIONS_KEY].append({})
-          result[constants.PREDICTIONS_KEY][i].update({spec.name: output})
+      model_util.add_batched_outputs_to_extracts(
+          result, outputs, spec.name,
+          len(self._eval_config.model_specs) > 1, len(feature_rows))
     return [result]
 
 
@@ -177,6 +243,8 @@ def TFLitePredictExtractor(
   extract added for the predictions keyed by tfma.PREDICTIONS_KEY. The model
   inputs are searched for under tfma.FEATURES_KEY. If multiple
   models are used the predictions will be stored in a dict keyed by model name.
+  The batched model outputs are also stored under tfma.PREDICTIONS_COLUMNS_KEY
+  as a dict of output name to batched array.
 
   Args:
     eval_config: Eval config.
@@ -19,6 +19,8 @@ import tempfile
 from absl.testing import parameterized
 import apache_beam as beam
 from apache_beam.testing import util
+import numpy as np
+import pyarrow as pa
 import tensorflow as tf
 from tensorflow_model_analysis import constants
 from tensorflow_model_analysis.api import model_eval_lib
@@ -35,6 +37,150 @@ from tensorflow_metadata.proto.v0 import schema_pb2
 class TFLitePredictExtractorTest(testutil.TensorflowModelAnalysisTest,
                                  parameterized.TestCase):
 
+  def _createTFLiteModel(self):
+    input1 = tf.keras.layers.Input(shape=(1,), name='input1')
+    input2 = tf.keras.layers.Input(shape=(1,), name='input2')
+    inputs = [input1, input2]
+    input_layer = tf.keras.layers.concatenate(inputs)
+    output_layer = tf.keras.layers.Dense(
+        1, activation=tf.nn.sigmoid, name='output')(
+            input_layer)
+    model = tf.keras.models.Model(inputs, output_layer)
+
+    converter = tf.compat.v2.lite.TFLiteConverter.from_keras_model(model)
+    tflite_model = converter.convert()
+
+    tflite_model_dir = tempfile.mkdtemp()
+    with tf.io.gfile.GFile(os.path.join(tflite_model_dir, 'tflite'), 'wb') as f:
+      f.write(tflite_model)
+    return tflite_model_dir
+
+  def _createFixedBatchSizeTFLiteModel(self):
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([1, 1], tf.float32, name='input1'),
+        tf.TensorSpec([1, 1], tf.float32, name='input2')
+    ])
+    def predict(input1, input2):
+      # The reshape only supports a batch size of 1, so allocating the tensors
+      # for any larger batch size fails.
+      values = tf.reshape(tf.concat([input1, input2], axis=1), [2])
+      return tf.reduce_sum(values, keepdims=True)
+
+    converter = tf.compat.v2.lite.TFLiteConverter.from_concrete_functions(
+        [predict.get_concrete_function()])
+    tflite_model = converter.convert()
+
+    tflite_model_dir = tempfile.mkdtemp()
+    with tf.io.gfile.GFile(os.path.join(tflite_model_dir, 'tflite'), 'wb') as f:
+      f.write(tflite_model)
+    return tflite_model_dir
+
+  def _createPredictionDoFn(self, tflite_model_dir):
+    eval_config = config_pb2.EvalConfig(
+        model_specs=[config_pb2.ModelSpec(model_type='tf_lite')])
+    eval_shared_model = self.createTestEvalSharedModel(
+        eval_saved_model_path=tflite_model_dir, model_type='tf_lite')
+    prediction_fn = tflite_predict_extractor._TFLitePredictionDoFn(  # pylint: disable=protected-access
+        eval_config=eval_config,
+        eval_shared_models={eval_shared_model.model_name: eval_shared_model})
+    prediction_fn.setup()
+    return prediction_fn
+
+  def _predict(self, prediction_fn, feature_rows):
+    result = prediction_fn._batch_reducible_process(  # pylint: disable=protected-access
+        {constants.FEATURES_KEY: feature_rows})
+    self.assertLen(result, 1)
+    return result[0][constants.PREDICTIONS_KEY]
+
+  def testTFLitePredictExtractorWithDifferentBatchSizes(self):
+    prediction_fn = self._createPredictionDoFn(self._createTFLiteModel())
+    feature_rows = [{
+        'input1': np.array([float(i)], dtype=np.float32),
+        'input2': np.array([1.0 - i], dtype=np.float32)
+    } for i in range(3)]
+    # The inputs need to be resized for each batch size, including when
+    # going back to a previously used batch size.
+    got_batch3 = self._predict(prediction_fn, feature_rows)
+    got_batch1 = self._predict(prediction_fn, feature_rows[2:])
+    got_batch2 = self._predict(prediction_fn, feature_rows[:2])
+    got_batch3_again = self._predict(prediction_fn, feature_rows)
+    self.assertLen(got_batch3, 3)
+    self.assertLen(got_batch1, 1)
+    self.assertLen(got_batch2, 2)
+    np.testing.assert_allclose(got_batch1, got_batch3[2:])
+    np.testing.assert_allclose(got_batch2, got_batch3[:2])
+    np.testing.assert_allclose(got_batch3_again, got_batch3)
+
+  def testTFLitePredictExtractorFallsBackToBatchSizeOne(self):
+    prediction_fn = self._createPredictionDoFn(
+        self._createFixedBatchSizeTFLiteModel())
+    feature_rows = [{
+        'input1': np.array([float(i)], dtype=np.float32),
+        'input2': np.array([10.0], dtype=np.float32)
+    } for i in range(3)]
+    element = {
+        constants.ARROW_RECORD_BATCH_KEY:
+            pa.RecordBatch.from_arrays([pa.array([[0], [1], [2]])],
+                                       ['feature']),
+        constants.FEATURES_KEY:
+            feature_rows
+    }
+    # Allocating the tensors for a batch size of 3 fails, after which the
+    # examples are run through the model one at a time.
+    for _ in range(2):
+      result = prediction_fn.process(element)
+      self.assertLen(result, 3)
+      for i, got in enumerate(result):
+        self.assertLen(got[constants.PREDICTIONS_KEY], 1)
+        np.testing.assert_allclose(got[constants.PREDICTIONS_KEY][0],
+                                   [i + 10.0])
+
+  def testTFLitePredictExtractorWithMissingFeature(self):
+    prediction_fn = self._createPredictionDoFn(self._createTFLiteModel())
+    expected = self._predict(prediction_fn, [{
+        'input1': np.array([0.0], dtype=np.float32),
+        'input2': np.array([-1.0], dtype=np.float32)
+    }, {
+        'input1': np.array([1.0], dtype=np.float32),
+        'input2': np.array([1.0], dtype=np.float32)
+    }])
+    # Missing features are set to -1 for float inputs.
+    got = self._predict(prediction_fn, [{
+        'input1': np.array([0.0], dtype=np.float32)
+    }, {
+        'input1': np.array([1.0], dtype=np.float32),
+        'input2': np.array([1.0], dtype=np.float32)
+    }])
+    np.testing.assert_allclose(got, expected)
+
+  def testTFLitePredictExtractorWithNoneFeatureValue(self):
+    prediction_fn = self._createPredictionDoFn(self._createTFLiteModel())
+    expected = self._predict(prediction_fn, [{
+        'input1': np.array([0.0], dtype=np.float32),
+        'input2': np.array([-1.0], dtype=np.float32)
+    }, {
+        'input1': np.array([1.0], dtype=np.float32),
+        'input2': np.array([1.0], dtype=np.float32)
+    }])
+    # Values containing None are treated as missing and set to the default.
+    got = self._predict(prediction_fn, [{
+        'input1': np.array([0.0], dtype=np.float32),
+        'input2': np.array([None], dtype=object)
+    }, {
+        'input1': np.array([1.0], dtype=np.float32),
+        'input2': np.array([1.0], dtype=np.float32)
+    }])
+    np.testing.assert_allclose(got, expected)
+
+  def testTFLitePredictExtractorWithIncompatibleFeatureType(self):
+    prediction_fn = self._createPredictionDoFn(self._createTFLiteModel())
+    with self.assertRaisesRegex(ValueError, 'not compatible'):
+      self._predict(prediction_fn, [{
+          'input1': np.array([b'0.5'], dtype=object),
+          'input2': np.array([1.0], dtype=np.float32)
+      }])
+
   @parameterized.named_parameters(('single_model_single_output', False, False),
                                   ('single_model_multi_output', False, True),
                                   ('multi_model_single_output', True, False),
@@ -152,6 +298,15 @@ class TFLitePredictExtractorTest(testutil.TensorflowModelAnalysisTest,
               self.assertIn('Identity', item)
               self.assertIn('Identity_1', item)
 
+          self.assertIn(constants.PREDICTIONS_COLUMNS_KEY, got)
+          prediction_columns = got[constants.PREDICTIONS_COLUMNS_KEY]
+          if multi_model:
+            self.assertCountEqual(['model1', 'model2'], prediction_columns)
+            prediction_columns = prediction_columns['model1']
+          self.assertLen(prediction_columns, 2 if multi_output else 1)
+          for column in prediction_columns.values():
+            self.assertLen(column, 2)
+
         except AssertionError as err:
           raise util.BeamAssertException(err)
 
@@ -27,9 +27,10 @@ UNBATCH_EXTRACTOR_STAGE_NAME = 'ExtractUnbatchedInputs'
 def UnbatchExtractor() -> extractor.Extractor:
   """Creates an extractor for unbatching batched extracts.
 
-  This extractor removes Arrow RecordBatch from the batched extract and outputs
-  per-example extracts with the remaining keys. We assume that the remaining
-  keys in the input extract contain list of objects (one per example).
+  This extractor removes Arrow RecordBatch and batched predictions from the
+  batched extract and outputs per-example extracts with the remaining keys. We
+  assume that the remaining keys in the input extract contain list of objects
+  (one per example).
 
   Returns:
     Extractor for unbatching batched extracts.
@@ -43,8 +44,8 @@ def _ExtractUnbatchedInputs(
     batched_extract: types.Extracts) -> Sequence[types.Extracts]:
   """Extract features, predictions, labels and weights from batched extract."""
   keys_to_retain = set(batched_extract.keys())
-  if constants.ARROW_RECORD_BATCH_KEY in keys_to_retain:
-    keys_to_retain.remove(constants.ARROW_RECORD_BATCH_KEY)
+  keys_to_retain.discard(constants.ARROW_RECORD_BATCH_KEY)
+  keys_to_retain.discard(constants.PREDICTIONS_COLUMNS_KEY)
   dataframe = pd.DataFrame()
   for key in keys_to_retain:
     if isinstance(batched_extract[key], Mapping) and not batched_extract[key]:
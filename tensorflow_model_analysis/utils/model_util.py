@@ -327,6 +327,65 @@ def get_feature_values_for_model_spec_field(
   return batched_values if not all_none else None
 
 
+def add_batched_outputs_to_extracts(extracts: types.Extracts,
+                                    batched_outputs: Dict[str, np.ndarray],
+                                    model_name: str, multi_model: bool,
+                                    batch_size: int) -> None:
+  """Adds the batched outputs of a model to the predictions in the extracts.
+
+  The batched outputs are split into per-example predictions stored under
+  tfma.PREDICTIONS_KEY and are also stored as is under
+  tfma.PREDICTIONS_COLUMNS_KEY. Callers should reset both keys before adding
+  the outputs of the first model.
+
+  Args:
+    extracts: Extracts to update in place.
+    batched_outputs: Model outputs keyed by output name. Each output contains
+      the values for the whole batch.
+    model_name: Name of the model the outputs were computed by.
+    multi_model: True if multiple models are used, in which case the
+      predictions are stored in dicts keyed by model name.
+    batch_size: Number of examples in the batch.
+
+  Raises:
+    ValueError: If an output does not contain one value per example.
+  """
+  for output in batched_outputs.values():
+    if len(output) != batch_size:
+      raise ValueError('Did not get the expected number of results.')
+
+  # Split the batched outputs into per-example predictions by iterating over
+  # the outputs once rather than indexing every output for every example.
+  if len(batched_outputs) == 1:
+    predictions = list(next(iter(batched_outputs.values())))
+  else:
+    output_names = list(batched_outputs.keys())
+    predictions = [
+        dict(zip(output_names, row)) for row in zip(*batched_outputs.values())
+    ]
+
+  if not multi_model:
+    extracts[constants.PREDICTIONS_KEY] = predictions
+    extracts[constants.PREDICTIONS_COLUMNS_KEY] = batched_outputs
+  else:
+    if not extracts[constants.PREDICTIONS_KEY]:
+      extracts[constants.PREDICTIONS_KEY] = [{} for _ in range(batch_size)]
+    for prediction, output in zip(extracts[constants.PREDICTIONS_KEY],
+                                  predictions):
+      prediction[model_name] = output
+    extracts[constants.PREDICTIONS_COLUMNS_KEY][model_name] = batched_outputs
+
+
+def _slice_batched_outputs(batched_outputs: Any, index: int) -> Any:
+  """Returns the batched outputs restricted to the example at index."""
+  if isinstance(batched_outputs, dict):
+    return {
+        k: _slice_batched_outputs(v, index)
+        for k, v in batched_outputs.items()
+    }
+  return batched_outputs[index:index + 1]
+
+
 def get_default_signature_name(model: Any) -> str:
   """Returns default signature name for given model."""
   # First try 'predict' then try 'serving_default'. The estimator output
@@ -783,6 +842,10 @@ class BatchReducibleBatchedDoFnWithModels(DoFnWithModels):
         for key in element.keys():
           if key == constants.ARROW_RECORD_BATCH_KEY:
             unbatched_element[key] = record_batch.slice(i, 1)
+          elif key == constants.PREDICTIONS_COLUMNS_KEY:
+            # Batched predictions are dicts of batched arrays rather than lists
+            # with one entry per example, so slice out a batch of size 1.
+            unbatched_element[key] = _slice_batched_outputs(element[key], i)
           else:
             unbatched_element[key] = [element[key][i]]
         result.extend(self._batch_reducible_process(unbatched_element))
@@ -246,6 +246,96 @@ class ModelUtilTest(testutil.TensorflowModelAnalysisTest,
       tf.saved_model.save(model, export_path, signatures=signatures)
     return export_path
 
+  def testAddBatchedOutputsToExtracts(self):
+    extracts = {
+        constants.PREDICTIONS_KEY: [],
+        constants.PREDICTIONS_COLUMNS_KEY: {}
+    }
+    outputs = {'output': np.array([[1.0], [2.0]])}
+    model_util.add_batched_outputs_to_extracts(extracts, outputs, '', False, 2)
+    self.assertIs(extracts[constants.PREDICTIONS_COLUMNS_KEY], outputs)
+    self.assertLen(extracts[constants.PREDICTIONS_KEY], 2)
+    np.testing.assert_array_equal(extracts[constants.PREDICTIONS_KEY][0], [1.0])
+    np.testing.assert_array_equal(extracts[constants.PREDICTIONS_KEY][1], [2.0])
+
+  def testAddBatchedOutputsToExtractsMultiOutputMultiModel(self):
+    extracts = {
+        constants.PREDICTIONS_KEY: [],
+        constants.PREDICTIONS_COLUMNS_KEY: {}
+    }
+    outputs1 = {'output': np.array([1.0, 2.0])}
+    outputs2 = {'output1': np.array([3.0, 4.0]), 'output2': np.array([5, 6])}
+    model_util.add_batched_outputs_to_extracts(extracts, outputs1, 'model1',
+                                               True, 2)
+    model_util.add_batched_outputs_to_extracts(extracts, outputs2, 'model2',
+                                               True, 2)
+    self.assertEqual(extracts[constants.PREDICTIONS_COLUMNS_KEY], {
+        'model1': outputs1,
+        'model2': outputs2
+    })
+    self.assertEqual(extracts[constants.PREDICTIONS_KEY], [{
+        'model1': 1.0,
+        'model2': {
+            'output1': 3.0,
+            'output2': 5
+        }
+    }, {
+        'model1': 2.0,
+        'model2': {
+            'output1': 4.0,
+            'output2': 6
+        }
+    }])
+
+  def testAddBatchedOutputsToExtractsRaisesOnWrongBatchSize(self):
+    extracts = {
+        constants.PREDICTIONS_KEY: [],
+        constants.PREDICTIONS_COLUMNS_KEY: {}
+    }
+    with self.assertRaisesRegex(ValueError, 'expected number of results'):
+      model_util.add_batched_outputs_to_extracts(
+          extracts, {'output': np.array([1.0])}, '', False, 2)
+
+  def testBatchReducibleBatchedDoFnWithModelsFallbackSlicesBatchedOutputs(
+      self):
+
+    class _FailOnBatchDoFn(model_util.BatchReducibleBatchedDoFnWithModels):
+
+      def _batch_reducible_process(self, element):
+        if len(element[constants.FEATURES_KEY]) > 1:
+          raise ValueError('batch too large')
+        return [element]
+
+    element = {
+        constants.ARROW_RECORD_BATCH_KEY:
+            pa.RecordBatch.from_arrays([pa.array([[1], [2]])], ['feature']),
+        constants.FEATURES_KEY: [{
+            'feature': 1
+        }, {
+            'feature': 2
+        }],
+        constants.PREDICTIONS_COLUMNS_KEY: {
+            'model1': {
+                'output': np.array([[1.0], [2.0]])
+            },
+            'model2': {
+                'output': np.array([3.0, 4.0])
+            }
+        }
+    }
+    result = _FailOnBatchDoFn({}).process(element)
+    self.assertLen(result, 2)
+    for i, unbatched_element in enumerate(result):
+      self.assertEqual(unbatched_element[constants.FEATURES_KEY],
+                       [{
+                           'feature': i + 1
+                       }])
+      prediction_columns = unbatched_element[constants.PREDICTIONS_COLUMNS_KEY]
+      np.testing.assert_array_equal(prediction_columns['model1']['output'],
+                                    [[i + 1.0]])
+      np.testing.assert_array_equal(prediction_columns['model2']['output'],
+                                    [i + 3.0])
+
   def testFilterByInputNames(self):
     tensors = {
         'f1': tf.constant([[1.1], [2.1]], dtype=tf.float32),